@@ -655,7 +655,8 @@ for E in E_list: #For each error to test
                 world = copy.deepcopy(world_pristine) #Make a new initial world copy
 
                 #Update average brain for this trial
-                avg_brain[:np.shape(Brain.AF)[1],:np.shape(Brain.AF)[2]] = avg_brain[:np.shape(Brain.AF)[1],:np.shape(Brain.AF)[2]] + (Brain.AF[1,:,:])/(1.0*Tests)
+                AF = Brain.AF #Built on each read- grab it once
+                avg_brain[:np.shape(AF)[1],:np.shape(AF)[2]] = avg_brain[:np.shape(AF)[1],:np.shape(AF)[2]] + (AF[1,:,:])/(1.0*Tests)
 
                 #Make up trial print data
                 Dd = [ctr,round(non_guess/(1.0*ctr),2),Brain.S]
@@ -152,9 +152,9 @@ for N in [2,3,4,5,6]:
                     ap = -1 #Initial action plan- initially -1
                     ap_L = 9999 #Initial plan length, initially unreasonably high
 
-                    #For each possible goal
-                    for sg in gs:
-                        acts,path = brain.find_path_native(si,sg) #Get a solution plan
+                    #Get a solution plan for each possible goal, from one search
+                    best,plans = brain.find_path_any_native(si,gs,_each=True)
+                    for acts,path in plans:
                         if acts != -1: #and random.random() < err: #If a viable plan is found - latter commented snip is for error inducement
                             if ap_L > len(path): #If the current path is shorter
                                 ap_L = len(path) #Set the new plan length to that of the one found
@@ -131,8 +131,8 @@ for P_thresh in [0.0,0.1,0.2,0.3]: #0% to 30% error induction
 
                     opts = [] #optional actions to take
                     if a > 1: #if not in the first two trials (the explore phase)
-                        for g in goals: #for each goal option
-                            acts,path = brain.find_path_native(si,g) #Find action sequence to goal
+                        best,plans = brain.find_path_any_native(si,goals,_each=True) #Find action sequences to all goals in one search
+                        for acts,path in plans: #for each goal option
                             if acts != -1: #If a path found
                                 opts = opts + [(acts,path,len(acts))] #Add it to options
                     else:
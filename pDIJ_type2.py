@@ -1,82 +1,495 @@
 # pDIJ Type-2 revision
 
-import math,time,random
+import math,time,heapq,itertools
 import numpy as np
 
-class LL:
-    #Linked list class implementation
-    #   mainly a tidy wrapper to enforce relationships (order/push/pop/remove only)
-
-    def __init__(self):
-        #list and length- len() felt messy
-        self.lit = []
-        self.len = 0
+def read_log(path,sep='\t'):
+    #Lazily read a transition log of s_i<sep>s_f<sep>a_k lines (environment
+    #  states as strings, action as an integer), one (s_i,s_f,a_k) at a time
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line != '':
+                si_e,sf_e,ak = line.split(sep)
+                yield si_e,sf_e,int(ak)
+
+def round_row(x):
+    #Round a row of counts to integers keeping its total (largest remainder)
+    #  so a rescaled integer row still adds up to its scaled total
+    fl = np.floor(x)
+    k = int(round(float(x.sum() - fl.sum())))
+    if k > 0:
+        fl[np.argsort(fl - x,kind='stable')[:k]] += 1
+    return fl
+
+class LLV:
+    #View of one [s_i,a_k] list of an LLA (push/pop/remove/iterate)
+
+    def __init__(self,_L,_si,_ak):
+        #Owning array and cell
+        self.L = _L
+        self.si = _si
+        self.ak = _ak
+
+    @property
+    def len(self):
+        #Length of the list
+        return int(self.L.lens[self.si,self.ak])
 
     def push(self,value):
         #Add one value to the front of the list
         if value != None:
-            self.lit = [value] + self.lit
-            self.len = self.len + 1
-        else:
-            return kl
+            self.L.push(self.si,self.ak,int(value))
 
     def pop(self):
         #Pop a value off the top of the list
-        if self.len > 0:
-            #Pull off the list destructively
-            val = self.lit[0]
-            self.lit = self.lit[1:]
-            self.len = self.len - 1
-            return val
-        else:
-            #Nothing if the list is empty
-            return None
+        return self.L.pop(self.si,self.ak)
 
     def remove(self,val):
         #Pull a specific value from the middle of the list
-        popd = -1
-        store = LL() #Stack to store previously checked values
-        while (popd != val) and (self.len != 0): #pull values off until you find ti
-            popd = self.pop()
-            if popd != val:
-                store.push(popd)
-        while store.len != 0: #Put everything back
-            self.push(store.pop())
+        self.L.remove(self.si,self.ak,int(val))
+
+    def __iter__(self):
+        #Walk the values front to back
+        val = int(self.L.head[self.si,self.ak])
+        while val != -1:
+            yield val
+            val = int(self.L.nxt[self.si,val])
 
     def __str__(self):
         #A string output for display
-        return str(self.lit)
+        return str(list(self))
 
 class LLA:
     #Linked-list array object
+    #   All of the lists share flat integer arrays instead of holding a list
+    #   object each: the nodes are the [s_i,s_f] cells, chained by nxt/prv
+    #   (-1 ends a chain), with a head and length per [s_i,a_k] list, and own
+    #   marking which a_k list a node is in (-1 for none). So a state sits in
+    #   at most one list per s_i, and pushing it moves it from any other.
 
     def __init__(self,_S,_A):
         #Init with S/A for width and depths
         self.S = _S
         self.A = _A
-        self.array = [LL() for a in range(self.S*self.A)] #An LL for each array cell
+        self.cap = max(self.S,1) #Allocated states, doubled as needed in add_state
+
+        self.head = -1*np.ones((self.cap,self.A),dtype=np.int32) #First node of each list
+        self.lens = np.zeros((self.cap,self.A),dtype=np.int32) #Length of each list
+        self.nxt = -1*np.ones((self.cap,self.cap),dtype=np.int32) #Following node
+        self.prv = -1*np.ones((self.cap,self.cap),dtype=np.int32) #Preceding node
+        self.own = -1*np.ones((self.cap,self.cap),dtype=np.min_scalar_type(-self.A)) #List holding the node
 
     def __getitem__(self,t):
         #fetch method
         si,ak = t
-        i = si*self.A + ak
-        return self.array[int(i)]
+        return LLV(self,int(si),int(ak))
 
     def __setitem__(self,t,lit):
-        #Set method
-        si,ak = t
-        i = si*self.A + ak
-        self.array[int(i)] = lit
+        #Set method- the [s_i,a_k] list takes on the values of lit, in order
+        si,ak = int(t[0]),int(t[1])
+        while self.lens[si,ak] != 0:
+            self.pop(si,ak)
+        for val in reversed(list(lit)):
+            self.push(si,ak,int(val))
+
+    def push(self,si,ak,sf):
+        #Add a node to the front of the [s_i,a_k] list
+        if self.own[si,sf] != -1: #Already in a list- unlink it first
+            self.unlink(si,sf)
+        h = self.head[si,ak]
+        self.nxt[si,sf] = h
+        self.prv[si,sf] = -1
+        if h != -1:
+            self.prv[si,h] = sf
+        self.head[si,ak] = sf
+        self.own[si,sf] = ak
+        self.lens[si,ak] += 1
+
+    def pop(self,si,ak):
+        #Pop the front node of the [s_i,a_k] list
+        h = int(self.head[si,ak])
+        if h == -1:
+            return None
+        self.unlink(si,h)
+        return h
+
+    def remove(self,si,ak,sf):
+        #Pull a node from the [s_i,a_k] list if it's in there
+        if ak != -1 and self.own[si,sf] == ak:
+            self.unlink(si,sf)
+
+    def unlink(self,si,sf):
+        #Bridge a node out of whichever list holds it
+        ak = self.own[si,sf]
+        n = self.nxt[si,sf]
+        p = self.prv[si,sf]
+        if p != -1:
+            self.nxt[si,p] = n
+        else:
+            self.head[si,ak] = n
+        if n != -1:
+            self.prv[si,n] = p
+        self.own[si,sf] = -1
+        self.lens[si,ak] -= 1
+
+    def add_state(self):
+        #Widen by one state, doubling the arrays when out of room
+        if self.S + 1 > self.cap:
+            cap_p = 2*self.cap
+
+            head_p = -1*np.ones((cap_p,self.A),dtype=np.int32)
+            head_p[:self.S,:] = self.head[:self.S,:]
+            self.head = head_p
+
+            lens_p = np.zeros((cap_p,self.A),dtype=np.int32)
+            lens_p[:self.S,:] = self.lens[:self.S,:]
+            self.lens = lens_p
+
+            nxt_p = -1*np.ones((cap_p,cap_p),dtype=np.int32)
+            nxt_p[:self.S,:self.S] = self.nxt[:self.S,:self.S]
+            self.nxt = nxt_p
+
+            prv_p = -1*np.ones((cap_p,cap_p),dtype=np.int32)
+            prv_p[:self.S,:self.S] = self.prv[:self.S,:self.S]
+            self.prv = prv_p
+
+            own_p = -1*np.ones((cap_p,cap_p),dtype=self.own.dtype)
+            own_p[:self.S,:self.S] = self.own[:self.S,:self.S]
+            self.own = own_p
+
+            self.cap = cap_p
+        self.S = self.S + 1
+
+class SINC:
+    #Sparse incrementor object
+    #   drop-in for the dense INC array, keeping only observed counts
+    #   as a successor->count map for each [s_i,a_k] cell. Counts are held
+    #   in the dense array's dtype, so they round (or truncate) the same
+
+    def __init__(self,_S,_A,_dtype=np.float64):
+        #Init with S/A for width and depths, laid out like the LLA
+        self.S = _S
+        self.A = _A
+        self.dtype = np.dtype(_dtype)
+        self.zero = self.dtype.type(0)
+        self.array = [{} for a in range(self.S*self.A)] #A count map for each array cell
 
+    def __getitem__(self,t):
+        #fetch method- [a_k,s_i,s_f] gives a count, [:,s_i,s_f] the counts over all actions
+        ak,si,sf = t
+        if isinstance(ak,slice):
+            return np.array([self.array[int(si*self.A + a)].get(int(sf),self.zero) for a in range(self.A)[ak]],dtype=self.dtype)
+        return self.array[int(si*self.A + ak)].get(int(sf),self.zero)
+
+    def __setitem__(self,t,val):
+        #Set method for a single count, cast as the dense array would (a zero count isn't kept)
+        ak,si,sf = t
+        val = self.dtype.type(val)
+        if val == 0:
+            self.array[int(si*self.A + ak)].pop(int(sf),None)
+        else:
+            self.array[int(si*self.A + ak)][int(sf)] = val
+
+    def scale(self,ak,si,f,rint=False):
+        #Rescale every count of the [s_i,a_k] cell in place (rounded for
+        #  integer counts, see round_row), returning the cell's new total.
+        #  Taken in successor order, so rounding ties go as in the dense array
+        cell = self.array[int(si*self.A + ak)]
+        sfs = sorted(cell)
+        vals = np.array([cell[sf] for sf in sfs],dtype=np.float64)*f
+        if rint:
+            vals = round_row(vals)
+        for j in range(len(sfs)):
+            self[ak,si,sfs[j]] = vals[j]
+        return vals.sum()
+
+    def row(self,ak,si):
+        #Successors with a count in the [s_i,a_k] cell
+        return list(self.array[int(si*self.A + ak)])
+
+    def add_state(self):
+        #Widen by one state- only the new row's cells, columns are implicit
+        self.S = self.S + 1
+        self.array.extend([{} for a in range(self.A)])
+
+class PWS:
+    #Planner workspace object
+    #   Per-state search arrays allocated once and reused by every query.
+    #   Rather than clearing them, each query takes a new generation number
+    #   and a cell only counts if its stamp matches it, so starting a search
+    #   is O(1) whatever the number of states
+
+    def __init__(self,_S):
+        #Init with S for width
+        self.S = _S
+        self.cap = max(self.S,1)
+        self.gen = 0 #Current query generation
+
+        self.done = np.zeros(self.cap,dtype=np.int64) #Generation a state was made permanent in
+        self.par = -1*np.ones(self.cap,dtype=np.int32) #Parent in the tree (-1 at the root)
+        self.dst = np.zeros(self.cap,dtype=np.int32) #Steps from the root
+        self.order = np.zeros(self.cap,dtype=np.int32) #States in the order made permanent
+        self.lab = np.zeros(self.cap,dtype=np.int64) #Generation a state was labelled (reached) in
+        self.P = np.zeros(self.cap) #Best probability found to a labelled state
+        self.n = 0 #Number of permanent states
+        self.heap = [] #Search boundary
+        self.loop = False #Whether the root can be come back to
+
+    def begin(self):
+        #Start a new query- everything stamped before is stale from here
+        self.gen = self.gen + 1
+        self.n = 0
+        del self.heap[:]
+        return self.gen
+
+    def label(self,s,p,P):
+        #Reach s through parent p with probability P (not yet permanent)
+        self.lab[s] = self.gen
+        self.par[s] = p
+        self.P[s] = P
+
+    def settle(self,s,p,d):
+        #Make s permanent with parent p, d steps out
+        self.done[s] = self.gen
+        self.par[s] = p
+        self.dst[s] = d
+        self.order[self.n] = s
+        self.n = self.n + 1
+
+    def tree(self):
+        #Compact parent-array copy of the current tree- aligned arrays of the
+        #  permanent states (in settle order), their parents and distances
+        st = self.order[:self.n].copy()
+        return st,self.par[st],self.dst[st]
+
+    def add_state(self):
+        #Widen by one state, doubling the arrays when out of room
+        if self.S + 1 > self.cap:
+            cap_p = 2*self.cap
+            for k in ['done','par','dst','order','lab','P']:
+                a = getattr(self,k)
+                a_p = np.zeros(cap_p,dtype=a.dtype)
+                a_p[:self.cap] = a
+                setattr(self,k,a_p)
+            self.cap = cap_p
+        self.S = self.S + 1
+
+class MPT:
+    #Max probability tree object
+    #   Tree of most probable paths rooted at a set of states, kept up to date
+    #   as edges change instead of being rebuilt. With rev it is rooted at
+    #   goals and followed backwards (each state's parent is its next step
+    #   toward the goals), otherwise it grows out from the roots.
+    #   An edge gaining probability re-relaxes from its child end only, an
+    #   edge losing it only matters if it is in the tree, and then just the
+    #   subtree below it is cut off and re-attached (Ramalingam-Reps style)
+
+    def __init__(self,_M,_roots,_rev):
+        #Init with the owning planner, root states and direction
+        self.M = _M
+        self.rev = _rev
+        self.roots = set(_roots)
+        self.S = self.M.S
+        self.P = np.zeros(max(self.S,1)) #Path probability to/from the roots (0 if unreachable)
+        self.par = -1*np.ones(len(self.P),dtype=np.int32) #Parent in the tree (-1 at roots and unreachable states)
+        self.dst = np.zeros(len(self.P),dtype=np.int32) #Steps to/from the roots
+        self.kids = [{} for a in range(self.S)] #Children of each state
+        self.build()
+
+    def w(self,u,v):
+        #Probability of the graph edge under tree edge u->v
+        if self.rev:
+            return self.M.prob(v,u)
+        return self.M.prob(u,v)
+
+    def outs(self,u):
+        #States that could hang from u, as (v,w(u,v)) pairs
+        if self.rev:
+            return [(v,self.M.prob(v,u)) for v in self.M.radjacency[u]]
+        return self.M.out(u)
+
+    def ins(self,v):
+        #States v could hang from
+        return self.M.adjacency[v] if self.rev else self.M.radjacency[v]
+
+    def attach(self,v,u,P):
+        #Hang v from u with probability P
+        if self.par[v] != -1:
+            self.kids[self.par[v]].pop(v,None)
+        self.par[v] = u
+        self.kids[u][v] = True
+        self.dst[v] = self.dst[u] + 1
+        self.P[v] = P
+
+    def build(self):
+        #Grow the whole tree from scratch
+        self.P[:] = 0.0
+        self.par[:] = -1
+        self.dst[:] = 0
+        self.kids = [{} for a in range(self.S)]
+        heap = []
+        for r in self.roots:
+            self.P[r] = 1.0
+            heap.append((-1.0,r))
+        heapq.heapify(heap)
+        self.relax(heap)
+
+    def relax(self,heap):
+        #Dijkstra outward from the (-probability,state) entries on the heap
+        #  only strictly better paths replace a parent, so the roots and
+        #  any state not improved on are left alone. Each state is settled
+        #  once (self-loops aside), as in search
+        P = self.P
+        done = set()
+        while len(heap) > 0:
+            P_u,u = heapq.heappop(heap)
+            P_u = -P_u
+            if P_u < P[u] or u in done: #Stale entry
+                continue
+            done.add(u)
+            for v,w in self.outs(u):
+                if v == u or v in done:
+                    continue
+                q = P_u*w
+                if q > P[v] and not(v in self.roots):
+                    self.attach(v,u,q)
+                    heapq.heappush(heap,(-q,v))
+
+    def edge(self,si,sf):
+        #Graph edge s_i->s_f changed probability (or came or went)
+        #  Whether it got better or worse is read off the tree's own label
+        if self.rev:
+            u,v = sf,si
+        else:
+            u,v = si,sf
+        if v in self.roots or u == v:
+            return
+        q = self.P[u]*self.w(u,v)
+
+        if q > self.P[v]:
+            #A better edge can only improve v and what hangs below it
+            self.attach(v,u,q)
+            self.relax([(-q,v)])
+
+        elif q < self.P[v] and self.par[v] == u:
+            #A worse tree edge- cut off the subtree under it
+            cut = [v]
+            k = 0
+            while k < len(cut):
+                cut.extend(self.kids[cut[k]])
+                k += 1
+            self.kids[u].pop(v,None)
+            for x in cut:
+                self.P[x] = 0.0
+                self.par[x] = -1
+                self.kids[x] = {}
+
+            #Re-attach each cut state by its best edge from outside the cut,
+            #  then settle the rest of the cut from those
+            heap = []
+            for x in cut:
+                b,q = -1,0.0
+                for y in self.ins(x):
+                    q_y = self.P[y]*self.w(y,x)
+                    if q_y > q:
+                        b,q = y,q_y
+                if b != -1:
+                    self.attach(x,b,q)
+                    heap.append((-q,x))
+            heapq.heapify(heap)
+            self.relax(heap)
+
+    def row(self,si,ak):
+        #Every s_i->s_f edge under action a_k changed by the same factor-
+        #  only the ones in the tree can matter
+        if self.rev:
+            sf = int(self.par[si])
+            if sf != -1 and self.M.AFa[si,sf] == ak:
+                self.edge(si,sf)
+        else:
+            for sf in list(self.kids[si]):
+                if self.M.AFa[si,sf] == ak:
+                    self.edge(si,sf)
+
+    def tree(self):
+        #Compact parent-array form- aligned arrays of the reachable states
+        #  (by index), their parents and distances
+        st = np.flatnonzero(self.P[:self.S] > 0.0)
+        return st,self.par[st],self.dst[st]
+
+    def far(self):
+        #States furthest (in steps) from the roots
+        st,_,d = self.tree()
+        return [int(x) for x in st[d == d.max()]]
+
+    def act(self,s):
+        #Next action from s along the tree toward the roots (rev), -1 if none
+        sk = int(self.par[s])
+        if sk == -1:
+            return -1
+        return int(self.M.AFa[s,sk])
+
+    def path(self,s):
+        #Most probable acts,path between s and the roots (-1,-1 if unreachable)
+        if self.P[s] <= 0.0:
+            return -1,-1
+        path = [s]
+        sk = int(self.par[s])
+        while sk != -1:
+            path.append(sk)
+            sk = int(self.par[sk])
+        if not(self.rev):
+            path.reverse()
+        acts = [int(self.M.AFa[path[a],path[a+1]]) for a in range(len(path)-1)]
+        return acts,path
+
+    def add_state(self):
+        #Widen by one (unreachable) state, doubling the arrays when out of room
+        if self.S + 1 > len(self.P):
+            cap_p = 2*len(self.P)
+            P_p = np.zeros(cap_p)
+            P_p[:self.S] = self.P[:self.S]
+            self.P = P_p
+            par_p = -1*np.ones(cap_p,dtype=np.int32)
+            par_p[:self.S] = self.par[:self.S]
+            self.par = par_p
+            dst_p = np.zeros(cap_p,dtype=np.int32)
+            dst_p[:self.S] = self.dst[:self.S]
+            self.dst = dst_p
+        self.kids.append({})
+        self.S = self.S + 1
 
 class pDIJ_type2:
     #Probabilistic implementation of Dijkstra's algorithm on ALL datastructures
 
-    def __init__(self,_S,_A,_P,_cR,_cT):
+    def __init__(self,_S,_A,_P,_cR,_cT,_sparse=False,_cnt_dtype=np.float64,_act_dtype=np.int32,_prob_dtype=np.float64,_window=0):
         #Initialize state space size and action space size
         self.S = _S
         self.A = _A
 
+        #Numeric types of the model arrays
+        #  counts (INC, AK) may be float32 or an integer type, actions
+        #  (AFa) as small as uint8/uint16, probability arrays handed out
+        #  (AFp) float32
+        self.cnt_dtype = np.dtype(_cnt_dtype)
+        self.act_dtype = np.dtype(_act_dtype)
+        self.prob_dtype = np.dtype(_prob_dtype)
+        self.cnt_int = (self.cnt_dtype.kind in 'iu') #Integer counts round on rescale
+
+        #'No action' flag- -1, or the top value for unsigned action types
+        if self.act_dtype.kind == 'u':
+            self.A_none = int(np.iinfo(self.act_dtype).max)
+        else:
+            self.A_none = -1
+        if self.A > np.iinfo(self.act_dtype).max or self.A == self.A_none:
+            raise ValueError("action dtype "+str(self.act_dtype)+" cannot index "+str(self.A)+" actions")
+
+        #Allocated state capacity of the model arrays- S is the live size,
+        #  the arrays below are views over the first S states of buffers
+        #  cap states wide (see grow)
+        self.cap = max(self.S,1)
+
         #Lookup tables for string formatted state inputs
         self.E2S = {} #Environment (string) to state (index)
         self.S2E = {} #State (index) to Environment (string)
@@ -94,20 +507,52 @@ class pDIJ_type2:
         self.cnt_reset = _cR #number of observations to pin as max
         self.cnt_thresh = _cT #number of observations to trigger a re-scale at
 
+        # Sliding window learning rate- with a window, the [s_i,a_k] counts
+        #   are exactly the last window outcomes seen, held in a ring buffer
+        #   per [s_i,a_k] (made on first use) as [successors,next slot], and
+        #   replace the rescaling above. AK then counts the outcomes held
+        self.window = int(_window or 0)
+        self.ring = {}
+
         # Root incrementor array
-        self.INC = np.zeros((self.A,self.S,self.S))  #Counts of all events
+        #   dense A*S*S array, or the sparse SINC whose memory follows
+        #   the number of observed transitions rather than S^2
+        self.sparse = _sparse
+        if self.sparse:
+            self.INC = SINC(self.S,self.A,self.cnt_dtype)
+        else:
+            self.INC_c = np.zeros((self.A,self.cap,self.cap),dtype=self.cnt_dtype)  #Counts of all events
         self.INC_sum = 0 #Total number of observations
 
+        # Lazy rescaling of the incrementor
+        #   INC holds raw counts- the effective count is INC[ak,si,sf]*INC_scale[si,ak].
+        #   A rescale just shrinks the [s_i,a_k] multiplier (O(1)) and new
+        #   observations add 1/INC_scale raw, so the row never has to be touched.
+        #   INC_epoch counts rescales since the raw row was last folded back to
+        #   a multiplier of 1, which happens every INC_fold rescales to keep
+        #   the raw values in floating point range (the multiplier stays above
+        #   about max**-1/3 of the count type). Integer counts can't hold
+        #   fractional raw units, so they fold- rounded- on every rescale
+        self.INC_scale_c = np.ones((self.cap,self.A))
+        self.INC_epoch_c = np.zeros((self.cap,self.A),dtype=np.int32)
+        f = 1.0*self.cnt_reset/self.cnt_thresh
+        if 0.0 < f < 1.0 and not(self.cnt_int):
+            self.INC_fold = max(1,int(math.log(np.finfo(self.cnt_dtype).max)/(-3.0*math.log(f))))
+        else:
+            self.INC_fold = 1 #integer counts or degenerate rates- fold on every rescale
+
         # Array tracking |a_i(s_j) -> s_x|
         #   AK[ak,si] = |a_i(s_j)| 
-        self.AK = np.zeros((self.S,self.A))
+        self.AK_c = np.zeros((self.cap,self.A),dtype=self.cnt_dtype)
 
         # Array tracking a_x(s_j) -> s_k
         #   Tracks which action causes s_j->s_k most
         #   reliably based on AK.
-        self.AF = np.zeros((2,self.S,self.S))
-        self.AF[0,:,:] = -1*np.ones((self.S,self.S))
-        # [a_?,P_?jk]
+        #   AFa holds the action index (A_none if unassigned). Its probability
+        #   isn't stored- it moves with AK[s_j,a_x] for every s_k at once,
+        #   so it is read off the counts instead (see prob). AF gives the
+        #   two stacked as the original [a_?,P_?jk] float array
+        self.AFa_c = np.full((self.cap,self.cap),self.A_none,dtype=self.act_dtype)
 
         #Array linked list object
         ###
@@ -116,26 +561,178 @@ class pDIJ_type2:
         #  s_f for which a_k is the most likely transition
         #  These are linked lists embedded within the array
         #  and maintained in sorted order all the time (see below)
+        #  Unobserved s_f start out unassigned- in no list, with
+        #  no AF action- and join a list on their first observation
         ###
         self.AL = LLA(self.S,self.A)
 
-        # Populate ALL w/ initial link objects
-        for si in range(self.S):
-            for sf in range(self.S):
-                akf = random.randint(0,self.A-1) #Initial random 'most likely' action
-                self.AL[si,akf].push(sf)
-                self.AF[0,si,sf] = akf
-
-        #Adjacenct map- initially empty
-        self.adjacency = [[]]*self.S #Adjacency lists
-        self.adj = -1*np.ones((self.S,self.S)) #Flag map for adjacency checks
+        #Switch points- for each [s_i,a_k] list, a heap of (raw AK,s_f): the
+        #  raw AK[s_i,a_k] (AK/INC_scale) past which s_f's probability under
+        #  a_k falls below its next best action's (or below P_thresh, for an
+        #  edge). sw_at holds each s_f's live entry, the rest are stale.
+        #  See relink and rerow
+        self.sw = {}
+        self.sw_at = {}
+
+        #Adjacency index- initially empty
+        #  One insertion-ordered dict per state keyed by successor, so
+        #  insert, delete and membership are O(1) and iteration is in order.
+        #  Each edge holds [action,raw count] (see prob)
+        self.adjacency = [{} for a in range(self.S)]
+        self.radjacency = [{} for a in range(self.S)] #Reverse index, predecessor keyed
+
+        #Per-state copies of the INC_scale and AK rows as plain lists, so
+        #  prob can turn an edge's raw count into its probability without
+        #  numpy scalar indexing in the planners' inner loops. Refreshed by
+        #  relink and rerow, which every change to AK or INC_scale goes through.
+        #  outs holds each state's out() row until then (None once stale)
+        self.norm = [([1.0]*self.A,[0]*self.A) for a in range(self.S)]
+        self.outs = [None for a in range(self.S)]
+
+        #Reachability index- for each goal asked about, the set of states
+        #  with a path of one step or more into it. New edges extend the sets
+        #  in place, while a lost edge drops any set it may have been holding
+        #  together, to be rebuilt on next use. The reach_max most recently
+        #  used goals are held
+        self.reach = {}
+        self.reach_max = 64
+
+        #All-pairs closure- best path probability and next state for every
+        #  (s_i,s_g), rebuilt on demand when edges have changed since (AF_v
+        #  counts edge probability changes, PC_v is the count it was built at)
+        self.AF_v = 0
+        self.PC_v = -1
+        self.PC = None
+        self.NH = None
+
+        #A* bound caches- each state's best outgoing probability (brought up
+        #  to date for the states in mo_due, those relink or rerow touched,
+        #  when next asked for), and hop distances into the last goal asked
+        #  about (as of adj_v, which counts adjacency changes)
+        self.adj_v = 0
+        self.mo = [0.0 for a in range(self.S)]
+        self.mo_due = set()
+        self.hop_c = (-1,-1,-1,None)
+
+        #Max probability trees kept up to date by relink- the goal policy
+        #  tables, keyed by goal set
+        self.trees = []
+        self.policies = {}
+
+        #Search workspace shared by the planning queries
+        self.ws = PWS(self.S)
+        self.wsb = PWS(self.S) #Backward half of bidirectional searches
+
+        #Views over the live region
+        self.view()
 
         #Containers for prior actions and plan trees
-        self.last_tree = -1
-        self.d_m_list = -1
+        #  src is the source-rooted tree a full search leaves behind- kept
+        #  repaired (and read by last_tree/d_m_list) until the next search
+        self.src = None
+        self.tree_c = -1
+        self.d_m_c = -1
         self.last_plan = [-1],[-1]
         self.last_goal = -1
 
+        #Plan cache- the plan_max most recently made plans, keyed by goal, as
+        #  [acts,path,index of each state on the path,lo], good from path
+        #  index lo on. watch maps each edge on a cached plan to the goals of
+        #  the plans using it, so when an edge changes action (or drops out)
+        #  relink moves just those plans' lo past it
+        self.plans = {}
+        self.plan_max = 16
+        self.watch = {}
+
+    def view(self):
+        #(Re)point the model arrays at the live S*S region of their buffers
+        if not(self.sparse):
+            self.INC = self.INC_c[:,:self.S,:self.S]
+        self.AK = self.AK_c[:self.S,:]
+        self.INC_scale = self.INC_scale_c[:self.S,:]
+        self.INC_epoch = self.INC_epoch_c[:self.S,:]
+        self.AFa = self.AFa_c[:self.S,:self.S]
+
+    @property
+    def AFp(self):
+        #S*S array of edge probabilities (0 off the edges), for callers
+        #  reading them all at once (built on each access- use prob in loops)
+        AFp = np.zeros((self.S,self.S),dtype=self.prob_dtype)
+        for si in range(self.S):
+            for sf,P in self.out(si):
+                AFp[si,sf] = P
+        return AFp
+
+    @property
+    def AF(self):
+        #[action,probability] array in the original float layout, for
+        #  callers reading AF directly (built on each access- index AFa/prob in loops)
+        AF = np.zeros((2,self.S,self.S))
+        AF[0,:,:] = np.where(self.AFa == self.A_none,-1.0,self.AFa)
+        AF[1,:,:] = self.AFp
+        return AF
+
+    @property
+    def last_tree(self):
+        #Parent-array tree of the last search
+        if self.src != None:
+            return self.src.tree()
+        return self.tree_c
+
+    @property
+    def d_m_list(self):
+        #States furthest out in the last search tree
+        if self.src != None:
+            return self.src.far()
+        return self.d_m_c
+
+    def grow(self):
+        #Extend the live region by one state
+        #  Buffers double when full, so discovering N states costs
+        #  amortized O(1) copying each rather than a full copy per state
+        if self.S + 1 > self.cap:
+            cap_p = 2*self.cap
+
+            #Build the larger buffers, fresh space set to the 'empty' values
+            AFa_p = np.full((cap_p,cap_p),self.A_none,dtype=self.act_dtype)
+            AFa_p[:self.S,:self.S] = self.AFa
+            self.AFa_c = AFa_p
+
+            AK_p = np.zeros((cap_p,self.A),dtype=self.cnt_dtype)
+            AK_p[:self.S,:] = self.AK
+            self.AK_c = AK_p
+
+            scale_p = np.ones((cap_p,self.A))
+            scale_p[:self.S,:] = self.INC_scale
+            self.INC_scale_c = scale_p
+
+            epoch_p = np.zeros((cap_p,self.A),dtype=np.int32)
+            epoch_p[:self.S,:] = self.INC_epoch
+            self.INC_epoch_c = epoch_p
+
+            if not(self.sparse):
+                INC_p = np.zeros((self.A,cap_p,cap_p),dtype=self.cnt_dtype)
+                INC_p[:,:self.S,:self.S] = self.INC
+                self.INC_c = INC_p
+
+            self.cap = cap_p
+
+        #Widen the live region and the per-state containers
+        self.S = self.S + 1
+        self.view()
+        self.AL.add_state()
+        if self.sparse:
+            self.INC.add_state()
+        self.adjacency.append({})
+        self.radjacency.append({})
+        self.norm.append(([1.0]*self.A,[0]*self.A))
+        self.outs.append(None)
+        self.mo.append(0.0)
+        self.ws.add_state()
+        self.wsb.add_state()
+        for t in self.trees:
+            t.add_state()
+
     def add_state(self, Es):
         #Method to add a new state on discovery
 
@@ -145,45 +742,13 @@ class pDIJ_type2:
             self.S2E[self.En] = Es #Add new environmental state
             self.En = self.En + 1 #Increment state counter
 
-            self.visit = self.visit + [1] #Add a new cell to the states-visited list
+            self.visit.append(1) #Add a new cell to the states-visited list
 
             #If adding that new state increased the number of states over the array size
             if self.En > self.S:
 
-                #Build and populate the new AF array
-                AF_p = np.zeros((2,self.S+1,self.S+1))
-                AF_p[0,:,:] = -1*np.ones((self.S+1,self.S+1))
-                AF_p[:,:-1,:-1] = self.AF
-                self.AF = AF_p
-
-                #Augment the main ALL object
-                self.AL.S = self.AL.S + 1
-                self.AL.array = self.AL.array + [LL() for a in range(self.A)]
-
-                #Add in new random first actions to the additional array space
-                for sf in range(self.S+1):
-                    akf = random.randint(0,self.A-1)
-                    self.AL[self.S,akf].push(sf)
-                    self.AF[0,self.S,sf] = akf
-
-                #Expand the AK array
-                AK_p = np.zeros((self.S+1,self.A))
-                AK_p[:-1,:] = self.AK
-                self.AK = AK_p
-
-                #Expand the incrementor
-                INC_p = np.zeros((self.A,self.S+1,self.S+1))
-                INC_p[:,:-1,:-1] = self.INC
-                self.INC = INC_p
-
-                #Augment the adjacency list and map
-                self.adjacency = self.adjacency + [[]]
-                adj_p = -1*np.ones((self.S+1,self.S+1))
-                adj_p[:-1,:-1] = self.adj
-                self.adj = adj_p
-
-                #Increase the size of the statespace
-                self.S = self.S + 1
+                #Widen the model arrays, AL, incrementor and adjacency lists
+                self.grow()
             return True
 
         #If it's not actually new, skip all that
@@ -208,11 +773,57 @@ class pDIJ_type2:
         #do the index-based update
         self.update(si,sf,ak)
         
+    def train_log(self,records,chunk=10000,offset=0,verbose=False,progress=None):
+        #Stream (s_i,s_f,a_k) environment-state records into the model
+        #  records is any iterable of them (or a log file path, see read_log),
+        #  read lazily chunk records at a time- states are interned through
+        #  E2S and each chunk goes in through update_many, so memory stays at
+        #  one chunk however long the log. The first offset records are
+        #  skipped, and the offset reached is returned, so a stopped run can
+        #  pick up where it left off. progress, if given, is called with the
+        #  offset reached after each chunk, so the offset can be saved along
+        #  with the model as a checkpoint. verbose prints throughput per chunk
+        if isinstance(records,str):
+            records = read_log(records)
+        records = itertools.islice(records,offset,None)
+
+        done = offset
+        t0 = time.time()
+        si = np.zeros(chunk,dtype=np.int64)
+        sf = np.zeros(chunk,dtype=np.int64)
+        ak = np.zeros(chunk,dtype=np.int64)
+        while True:
+            #Intern the next chunk of states
+            n = 0
+            for si_e,sf_e,a in itertools.islice(records,chunk):
+                self.add_state(si_e)
+                self.add_state(sf_e)
+                si[n] = self.E2S[si_e]
+                sf[n] = self.E2S[sf_e]
+                ak[n] = a
+                n += 1
+            if n == 0:
+                break
+
+            self.update_many(si[:n],sf[:n],ak[:n])
+            done = done + n
+            if progress != None:
+                progress(done)
+
+            if verbose:
+                dt = time.time()-t0
+                print(done,"records",round((done-offset)/max(dt,1e-9),1),"records/s",self.S,"states")
+            if n < chunk:
+                break
+        return done
+
     def update(self,si,sf,ak):
         #Index based update of the agent model
+        if self.window > 0:
+            return self.slide(si,sf,ak)
 
-        #Update the incrementor counter
-        self.INC[ak,si,sf] = self.INC[ak,si,sf] + 1
+        #Update the incrementor counter- one effective count in raw units
+        self.INC[ak,si,sf] = self.INC[ak,si,sf] + 1.0/self.INC_scale[si,ak]
         self.INC_sum = self.INC_sum + 1
 
         #Update the AK counter
@@ -222,81 +833,454 @@ class pDIJ_type2:
         self.visit[sf] = self.visit[sf] + 1
         self.visits = self.visits + 1
 
-        #Calculate the updated probability
-        P_n = self.INC[ak,si,sf]/self.AK[si,ak]
-
-        #Check if the new probability is above the viable-edge threshold
-        if self.adj[si,sf] == -1 and P_n > self.P_thresh:
-            #If sufficiently likely to be a viable edge, mark adjacency
-            self.adjacency[si] = self.adjacency[si] + [sf]
-            self.adj[si,sf] = 0
-        elif self.adj[si,sf] != -1 and P_n <= self.P_thresh:
-            #Otherwise, remove from adjacency list
-            self.adjacency[si].remove(sf)
-            self.adj[si,sf] = -1
-
-        #Check if updated probability is greater than current maximum
-        if (P_n > self.AF[1,si,sf]):
-            #if so, grab action associated with most-likely transition
-            a_p = self.AF[0,si,sf]
-
-            #Move the prior lead element back and the current one up to the front
-            self.AL[si,a_p].remove(sf)
-            self.AL[si,ak].push(sf)
-
-            #update AF array indices with action and probability
-            self.AF[0,si,sf] = ak
-            self.AF[1,si,sf] = P_n
-
-        #make a temporary stack
-        store = LL()
-
-        #empty prior ALL for this s/a pair
-        while self.AL[si,ak].len != 0:
-            #Pop each element
-            sl = self.AL[si,ak].pop()
-            as_Ps = self.INC[:,si,sl] #grab local slice of incrementor
-
-            #O(1) w/ INC update above tracking argmax in ak dir.
-            al_maxP = int(np.argmax(as_Ps)) #grab max probability element
-            self.AF[0,si,sl] = al_maxP  #get the actual probability
-
-            #If the AK component for that s/a pair is a real probability (observed)
-            if self.AK[si,al_maxP] > 0:
-                #update AF array with new peobability
-                self.AF[1,si,sl] = as_Ps[al_maxP]/self.AK[si,al_maxP]
-
-                #if the probability is less than the adjacency threshold
-                if self.AF[1,si,sl] < self.P_thresh:
-                    self.AF[0,si,sl] = -1 #Clear the action index flag
-                    self.AF[1,si,sl] = 0.0 #Set effective probability to 0
-                    try:
-                        self.adjacency[si].remove(sl) #Remove the state if it's in the adjacency list
-                        self.adj[si,sl] = -1 #clear the adjacency flag
-                    except:
-                        pass #Otherwise it's already not in there, ignore
-            #If the ALL component is not observed
-            else:
-                self.AF[1,si,sl] = 0.0 #Set to 0 probability
-                self.AF[0,si,sl] = -1 #Clear flag
-
-            #If the max probability is not the listed max
-            if al_maxP != ak:
-                self.AL[si,al_maxP].push(sl) #Add the state to the ALL element at that cell
-            else:
-                store.push(sl) #otherwise put it on the temporary stack
-
-        #Put the stack into the ALL
-        self.AL[si,ak] = store
-
         # Corrective factor to keep new samples relevant
         #  This is basically a parameterization of learning rate
+        folded = []
         if self.AK[si,ak] >= self.cnt_thresh: #If the count for this pair is past the threshold
             self.AK[si,ak] = self.cnt_reset #Rescale the counter to the reset value
-            self.INC[ak,si,:] = self.INC[ak,si,:]*(1.0*self.cnt_reset/self.cnt_thresh) #Rescale the incrementor to the new count value
+            folded = self.rescale(si,ak,1.0*self.cnt_reset/self.cnt_thresh) #Rescale the incrementor to the new count value
+        for sl in folded: #(a fold rewrote the raw row under each of these)
+            self.relink(si,sl)
+
+        #s_f is the only successor whose counts changed, so it is the only one
+        #  whose most likely action can have moved- re-derive it now, O(A)
+        self.relink(si,sf)
+
+        #Every other s_f in the [s_i,a_k] list only saw its probability drop
+        #  with the shared AK[s_i,a_k] denominator- just the ones that pass
+        #  their switch point are re-derived, so an update costs the same
+        #  however many successors have piled up
+        self.rerow(si,ak)
 
         return 1
 
+    def update_many(self,si,sf,ak):
+        #Batch update from arrays of observed (s_i,s_f,a_k), in order
+        #  Leaves the model as the same updates one at a time would (up to
+        #  the order within the AL lists). Observations are grouped by
+        #  [s_i,a_k]: within a group AK just counts up to cnt_thresh and
+        #  restarts from cnt_reset, so where each rescale lands- and with it
+        #  the raw weight 1/INC_scale of each observation- is known up front,
+        #  and the counts go in with one scatter-add. Groups that would fold
+        #  their raw row mid-batch go through update in order instead.
+        #  AF/AL/adjacency are then re-derived once per touched s_i->s_f
+        si = np.asarray(si,dtype=np.int64).ravel()
+        sf = np.asarray(sf,dtype=np.int64).ravel()
+        ak = np.asarray(ak,dtype=np.int64).ravel()
+        n = len(si)
+        if n == 0:
+            return 0
+
+        #Windows evict one by one
+        if self.window > 0:
+            for j in range(n):
+                self.slide(int(si[j]),int(sf[j]),int(ak[j]))
+            return n
+
+        f = 1.0*self.cnt_reset/self.cnt_thresh
+        L = max(1,int(math.ceil(self.cnt_thresh - self.cnt_reset))) #Observations between rescales
+
+        #Group by [s_i,a_k], keeping the observation order within each
+        key = si*self.A + ak
+        order = np.argsort(key,kind='stable')
+        k_o = key[order]
+        starts = np.flatnonzero(np.r_[True,k_o[1:] != k_o[:-1]])
+        ends = np.r_[starts[1:],n]
+
+        w = np.zeros(n) #Raw weight of each observation
+        batch = np.ones(n,dtype=bool) #Whether it goes in with the batch
+        groups = [] #[s_i,a_k] groups batched, with their final AK/scale/epoch
+        for g in range(len(starts)):
+            idx = order[starts[g]:ends[g]]
+            s,a = int(si[idx[0]]),int(ak[idx[0]])
+            m = len(idx)
+
+            #Rescales land on observation n1, then every L after
+            n1 = max(1,int(math.ceil(self.cnt_thresh - self.AK[s,a])))
+            r_n = 0 if m < n1 else 1 + (m-n1)//L
+
+            #A fold mid-batch rewrites the raw row- do this group one by one
+            if r_n > 0 and self.INC_epoch[s,a] + r_n >= self.INC_fold:
+                batch[idx] = False
+                continue
+
+            #Scale in force for each observation, multiplied out as update does
+            scales = [self.INC_scale[s,a]]
+            for r in range(r_n):
+                scales.append(scales[-1]*f)
+            j = np.arange(m)
+            w[idx] = 1.0/np.array(scales)[np.where(j < n1,0,1 + (j-n1)//L)]
+
+            AK_n = self.AK[s,a] + m if m < n1 else self.cnt_reset + (m-n1)%L
+            groups.append((s,a,AK_n,scales[-1],r_n))
+
+        #Groups that fold go through the one-at-a-time update
+        for j in np.flatnonzero(~batch):
+            self.update(int(si[j]),int(sf[j]),int(ak[j]))
+
+        #Scatter-add the batched counts (in order within each cell)
+        b_i,b_f,b_a,b_w = si[batch],sf[batch],ak[batch],w[batch]
+        if not(self.sparse) and self.cnt_int:
+            np.add.at(self.INC,(b_a,b_i,b_f),b_w.astype(self.cnt_dtype))
+        elif not(self.sparse) and self.cnt_dtype == np.float64:
+            np.add.at(self.INC,(b_a,b_i,b_f),b_w)
+        else:
+            #Sparse or narrower float counts- add as update would, rounding once per add
+            for j in range(len(b_i)):
+                self.INC[b_a[j],b_i[j],b_f[j]] = self.INC[b_a[j],b_i[j],b_f[j]] + b_w[j]
+        for s,a,AK_n,scale,r_n in groups:
+            self.AK[s,a] = AK_n
+            self.INC_scale[s,a] = scale
+            self.INC_epoch[s,a] = self.INC_epoch[s,a] + r_n
+
+        #Observation and visit counts
+        self.INC_sum = self.INC_sum + len(b_i)
+        self.visits = self.visits + len(b_i)
+        vs,vc = np.unique(b_f,return_counts=True)
+        for j in range(len(vs)):
+            self.visit[vs[j]] = self.visit[vs[j]] + int(vc[j])
+
+        #Re-derive each touched s_i->s_f once, from the final counts, then
+        #  the rest of each touched list past its switch point
+        for e in np.unique(b_i*self.S + b_f):
+            self.relink(int(e//self.S),int(e%self.S))
+        for s,a,AK_n,scale,r_n in groups:
+            self.rerow(s,a)
+
+        return n
+
+    def slide(self,si,sf,ak):
+        #Window mode update- s_f goes into the [s_i,a_k] ring buffer, and once
+        #  it is full, the oldest outcome drops out of the counts
+        R = self.ring.get(si*self.A + ak)
+        if R == None:
+            R = [[0]*self.window,0]
+            self.ring[si*self.A + ak] = R
+        buf,pos = R
+        full = (self.AK[si,ak] >= self.window)
+        so = buf[pos]
+        buf[pos] = sf
+        R[1] = (pos + 1) % self.window
+
+        self.INC[ak,si,sf] = self.INC[ak,si,sf] + 1
+        self.INC_sum = self.INC_sum + 1
+        self.visit[sf] = self.visit[sf] + 1
+        self.visits = self.visits + 1
+
+        if full:
+            #Evict the oldest- AK holds steady, so only s_f and the evicted
+            #  successor change probability, O(A) whatever the window or S
+            self.INC[ak,si,so] = self.INC[ak,si,so] - 1
+            if so != sf:
+                self.relink(si,so)
+        else:
+            #Still filling- the growing AK lowers the rest of the list too
+            self.AK[si,ak] = self.AK[si,ak] + 1
+        self.relink(si,sf)
+        if not(full):
+            self.rerow(si,ak)
+        return 1
+
+    def rescale(self,si,ak,f):
+        #Scale the effective [s_i,a_k] counts by f through the lazy multiplier
+        #  Returns the successors to re-derive- none, unless the row folded
+        self.INC_scale[si,ak] = self.INC_scale[si,ak]*f
+        self.INC_epoch[si,ak] = self.INC_epoch[si,ak] + 1
+
+        #Every INC_fold rescales, fold the multiplier into the raw row
+        #  Rounded integer rows can't land on cnt_reset exactly, so AK takes
+        #  the rounded row's total to keep the probabilities normalised.
+        #  Every successor in the row then has new raw counts (and rounding
+        #  may move its probabilities), so the row's switch points start over
+        if self.INC_epoch[si,ak] >= self.INC_fold:
+            row = self.succ(si,ak)
+            if self.sparse:
+                tot = self.INC.scale(ak,si,self.INC_scale[si,ak],self.cnt_int)
+            elif self.cnt_int:
+                self.INC[ak,si,:] = round_row(self.INC[ak,si,:]*self.INC_scale[si,ak])
+                tot = self.INC[ak,si,:].sum()
+            else:
+                self.INC[ak,si,:] = self.INC[ak,si,:]*self.INC_scale[si,ak]
+            if self.cnt_int:
+                self.AK[si,ak] = tot
+            self.INC_scale[si,ak] = 1.0
+            self.INC_epoch[si,ak] = 0
+            self.sw.pop(si*self.A + ak,None)
+            return row
+        return []
+
+    def succ(self,si,ak):
+        #Successors with a count in the [s_i,a_k] row
+        if self.sparse:
+            return self.INC.row(ak,si)
+        return [int(x) for x in np.flatnonzero(self.INC[ak,si,:])]
+
+    def relink(self,si,sf):
+        #Re-derive AF, AL membership, adjacency and the switch point of
+        #  s_i->s_f from the counts
+        self.norm[si] = (self.INC_scale[si,:].tolist(),self.AK[si,:].tolist())
+        self.outs[si] = None
+        self.mo_due.add(si)
+        as_Ps = self.INC[:,si,sf]*self.INC_scale[si,:] #grab local slice of effective counts
+
+        #Unobserved transitions stay unassigned- and ones whose every count
+        #  has gone (evicted from a window, or rounded away) become so again
+        if not(as_Ps.any()):
+            if self.AL.own[si,sf] == -1:
+                return
+            al_maxP = -1
+            P_n = 0.0
+        else:
+            #Probability of the transition under each observed action
+            #  (the lazy multipliers can leave a sure transition a rounding
+            #  error over 1, which would let a cycle gain probability)
+            as_Ps = np.divide(as_Ps,self.AK[si,:],out=np.zeros(self.A),where=self.AK[si,:]>0)
+            al_maxP = int(np.argmax(as_Ps)) #grab max probability element
+            P_n = min(as_Ps[al_maxP],1.0)
+        a_o = int(self.AFa[si,sf])
+
+        #Keep s_f in the list of its most likely action (in none if unobserved)
+        if al_maxP == -1:
+            self.AL.unlink(si,sf)
+        else:
+            self.AL[si,al_maxP].push(sf)
+
+        #Check if the probability is at or above the viable-edge threshold
+        if al_maxP != -1 and P_n >= self.P_thresh:
+            #update AF array indices with the action, and the edge with its raw count
+            self.AFa[si,sf] = al_maxP
+            e = self.adjacency[si].get(sf)
+            if e != None:
+                e[0] = al_maxP
+                e[1] = float(self.INC[al_maxP,si,sf])
+
+            #If sufficiently likely to be a viable edge, mark adjacency
+            else:
+                self.adjacency[si][sf] = [al_maxP,float(self.INC[al_maxP,si,sf])]
+                self.radjacency[sf][si] = True
+                self.adj_v = self.adj_v + 1
+
+                #Everything that reached s_f now reaches through s_i too
+                for g in self.reach:
+                    R = self.reach[g]
+                    if (sf in R or sf == g) and not(si in R):
+                        R.add(si)
+                        self.reach_back(R,[si])
+        else:
+            self.AFa[si,sf] = self.A_none #Clear the action index flag
+
+            #Otherwise, remove from adjacency index
+            if self.adjacency[si].pop(sf,None) != None:
+                self.radjacency[sf].pop(si,None)
+                self.adj_v = self.adj_v + 1
+
+                #Sets the edge may have been holding together are rebuilt on use
+                for g in [g for g in self.reach if si in self.reach[g] and (sf in self.reach[g] or sf == g)]:
+                    del self.reach[g]
+
+        #Plans over an edge that changed action or dropped out only hold past it
+        if a_o != self.A_none and int(self.AFa[si,sf]) != a_o:
+            for g in self.watch.pop((si,sf),()):
+                P = self.plans[g]
+                P[3] = max(P[3],P[2][si]+1)
+
+        #Switch point- as AK[s_i,a_k] grows, s_f's probability under a_k
+        #  falls, and once the raw AK passes INC/q (q the next best action's
+        #  probability, or P_thresh for an edge) s_f must be re-derived.
+        #  Other actions' probabilities only fall until s_f is re-derived,
+        #  so a switch point can come early but never late
+        self.sw_at.pop((si,sf),None)
+        if al_maxP != -1:
+            as_Ps[al_maxP] = 0.0
+            q = as_Ps.max()
+            if P_n >= self.P_thresh:
+                q = max(q,self.P_thresh)
+            if q > 0.0:
+                k = float(self.INC[al_maxP,si,sf])/q
+                self.sw_at[(si,sf)] = (al_maxP,k)
+                h = self.sw.setdefault(si*self.A + al_maxP,[])
+                heapq.heappush(h,(k,sf))
+                if len(h) > 2*self.AL.lens[si,al_maxP] + 8: #Mostly stale- compact it
+                    h[:] = [x for x in h if self.sw_at.get((si,x[1])) == (al_maxP,x[0])]
+                    heapq.heapify(h)
+
+        #Let the kept trees repair around the changed edge
+        self.AF_v = self.AF_v + 1
+        for t in self.trees:
+            t.edge(si,sf)
+
+    def rerow(self,si,ak):
+        #AK[s_i,a_k] or its multiplier moved, and every probability in the
+        #  [s_i,a_k] list with it. Only the s_f past their switch point can
+        #  have changed action or dropped out, so only those are re-derived,
+        #  off the list's heap- and the kept trees check their own edges
+        #  under a_k
+        self.AF_v = self.AF_v + 1
+        self.norm[si] = (self.INC_scale[si,:].tolist(),self.AK[si,:].tolist())
+        self.outs[si] = None
+        self.mo_due.add(si)
+        h = self.sw.get(si*self.A + ak)
+        if h != None and self.AK[si,ak] > 0:
+            R = (self.AK[si,ak]/self.INC_scale[si,ak])*(1.0 + 1e-9) #(ties are re-derived too)
+            due = {}
+            while len(h) > 0 and h[0][0] <= R:
+                k,sl = heapq.heappop(h)
+                if self.sw_at.get((si,sl)) == (ak,k):
+                    due[sl] = True
+            for sl in due:
+                self.relink(si,sl)
+        for t in self.trees:
+            t.row(si,ak)
+
+    def prob(self,si,sf):
+        #Probability of the s_i->s_f edge (0 if it isn't one)
+        #  off the edge's action and raw count, so it is always current
+        e = self.adjacency[si].get(sf)
+        if e == None:
+            return 0.0
+        sc,n = self.norm[si]
+        return min(e[1]*sc[e[0]]/n[e[0]],1.0)
+
+    def out(self,si):
+        #Every edge out of s_i with its probability, as (s_f,P) pairs in
+        #  adjacency order- prob for a whole row at once, kept until the
+        #  row's counts or edges next change
+        o = self.outs[si]
+        if o == None:
+            sc,n = self.norm[si]
+            o = [(sf,min(e[1]*sc[e[0]]/n[e[0]],1.0)) for sf,e in self.adjacency[si].items()]
+            self.outs[si] = o
+        return o
+
+    def closure(self):
+        #All-pairs max-probability closure of AF, with its next-hop matrix
+        #  Floyd-Warshall in max-product form, one vectorized S*S pass per
+        #  intermediate state- PC[s_i,s_g] is the best probability over paths
+        #  of one or more steps, NH[s_i,s_g] the first state after s_i on it
+        if self.PC_v != self.AF_v or np.shape(self.PC) != (self.S,self.S):
+            PC = np.array(self.AFp,dtype=np.float64)
+            NH = np.where(PC > 0.0,np.arange(self.S,dtype=np.int32)[None,:],-1).astype(np.int32)
+            better = np.zeros((self.S,self.S),dtype=bool)
+            via = np.zeros((self.S,self.S))
+            for k in range(self.S):
+                c_k = PC[:,k].copy() #Into k
+                r_k = PC[k,:].copy() #Out of k
+                if not(c_k.any() and r_k.any()):
+                    continue
+                np.multiply(c_k[:,None],r_k[None,:],out=via)
+                np.greater(via,PC,out=better)
+                np.copyto(PC,via,where=better)
+                np.copyto(NH,NH[:,k:k+1],where=better)
+            self.PC = PC
+            self.NH = NH
+            self.PC_v = self.AF_v
+        return self.PC,self.NH
+
+    def find_path_closure(self,si,sg):
+        #Most probable acts,path from si to sg read off the all-pairs closure
+        PC,NH = self.closure()
+        if PC[si,sg] <= 0.0:
+            return -1,-1
+        if si == sg: #Already there (the start can be come back to)
+            return [],[si]
+        path = [si]
+        sk = si
+        while len(path) == 1 or sk != sg:
+            sk = int(NH[sk,sg])
+            path.append(sk)
+        acts = [int(self.AFa[path[a],path[a+1]]) for a in range(len(path)-1)]
+        return acts,path
+
+    def reach_of(self,g):
+        #States with a path into g, from the index (built here if not held)
+        R = self.reach.pop(g,None)
+        if R == None:
+            R = set(self.radjacency[g])
+            self.reach_back(R,list(R))
+            if len(self.reach) >= self.reach_max: #Drop the least recently used
+                del self.reach[next(iter(self.reach))]
+        self.reach[g] = R #(Re)insert as most recently used
+        return R
+
+    def reach_back(self,R,stack):
+        #Grow R backwards along the edges from the states on the stack
+        while len(stack) > 0:
+            for y in self.radjacency[stack.pop()]:
+                if not(y in R):
+                    R.add(y)
+                    stack.append(y)
+
+    def reachable(self,si,sg):
+        #Whether any path leads from si to sg
+        return si in self.reach_of(sg)
+
+    def policy(self,goals):
+        #Goal-rooted max probability tree for a goal (or set of goals)
+        #  Built on first use, then repaired as the model changes, so each
+        #  state's next action toward the goals is a lookup from then on
+        if isinstance(goals,(int,np.integer)):
+            goals = [goals]
+        key = tuple(sorted(set(int(g) for g in goals)))
+        if not(key in self.policies):
+            t = MPT(self,key,True)
+            self.policies[key] = t
+            self.trees.append(t)
+        return self.policies[key]
+
+    def drop_policy(self,goals):
+        #Stop keeping the policy table for a goal set
+        if isinstance(goals,(int,np.integer)):
+            goals = [goals]
+        key = tuple(sorted(set(int(g) for g in goals)))
+        if key in self.policies:
+            self.trees.remove(self.policies.pop(key))
+
+    def next_action(self,si,goals):
+        #Most likely action from si toward the goals (-1 if none known)
+        return self.policy(goals).act(si)
+
+    def find_path_policy(self,si,goals):
+        #Most probable acts,path from si to the goals, read off the policy table
+        return self.policy(goals).path(si)
+
+    def remember(self,acts,path):
+        #Note a new plan as the last one, and cache it under its goal
+        self.last_plan = acts,path
+        if self.plan_max <= 0:
+            return
+        g = path[-1]
+        self.forget(g)
+        if len(self.plans) >= self.plan_max: #Drop the least recently used
+            self.forget(next(iter(self.plans)))
+        self.plans[g] = [acts,path,dict((path[i],i) for i in range(len(path))),0]
+        for i in range(len(path)-1):
+            self.watch.setdefault((path[i],path[i+1]),{})[g] = True
+
+    def forget(self,g):
+        #Drop the cached plan to g and its watches
+        P = self.plans.pop(g,None)
+        if P != None:
+            path = P[1]
+            for i in range(len(path)-1):
+                W = self.watch.get((path[i],path[i+1]))
+                if W != None:
+                    W.pop(g,None)
+                    if len(W) == 0:
+                        del self.watch[(path[i],path[i+1])]
+
+    def recall(self,si,sg):
+        #The cached plan to sg from si on, if si is on it and it still holds
+        P = self.plans.get(sg)
+        if P == None or not(si in P[2]):
+            return None
+        i = P[2][si]
+        if i < P[3]:
+            return None
+        self.plans[sg] = self.plans.pop(sg) #Most recently used
+        if i == 0:
+            return P[0],P[1]
+        return P[0][i:],P[1][i:]
+
     def check_prob(self,path):
         #A method to calculate the probability of completing a path
 
@@ -305,12 +1289,12 @@ class pDIJ_type2:
 
         #for each step in the path
         for a in range(len(path)-1):
-            P_joint = P_joint*self.AF[1,path[a],path[a+1]] #Cumulative probability
+            P_joint = P_joint*self.prob(path[a],path[a+1]) #Cumulative probability
             if P_joint == 0.0: #Stop as soon as probability goes to 0
                 return 0.0
         return P_joint
 
-    def find_path_native(self,si_e,sg_e,_verbose=False):
+    def find_path_native(self,si_e,sg_e,_verbose=False,_full=False,_h=None):
         #Get most likely path using environmental states
 
         #grab indices from lookup tables
@@ -318,154 +1302,481 @@ class pDIJ_type2:
         sg = self.E2S[sg_e]
 
         #Return path from index-based method
-        return self.find_path(si,sg,verbose=_verbose)
+        return self.find_path(si,sg,verbose=_verbose,full=_full,h=_h)
 
-    def find_path(self,si,sg,verbose=False):
-        #Find the most probable path from si to sg
+    def find_path_any_native(self,si_e,goals_e,_each=False,_full=False):
+        #Get most likely path to any of several goals using environmental states
+        si = self.E2S[si_e]
+        goals = [self.E2S[g] for g in goals_e]
+        return self.find_path_any(si,goals,each=_each,full=_full)
 
-        #Replanning- if returning to prior plan after diversion, can re-use it
-        if (sg in self.last_plan[1]) and (si in self.last_plan[1]): #If the goal and current state both in plan
-            if (self.check_prob(self.last_plan[1]) > 0.0): #If the probability has not been reset to 0 by the diversion updates
-                if (si == self.last_plan[1][0]): #If returned to the state from which the diversion occurred
-                    return self.last_plan #Return the old plan
-                else: #If on an non-prior state
-                    #grab the index of the current state on the prior plan
-                    si_index = max([i*(self.last_plan[1][i] == si) for i in range(len(self.last_plan[1]))])
-                    #Return the portion of the plan corresponding to the current state and later
-                    return self.last_plan[0][si_index:],self.last_plan[1][si_index:]
+    def find_path(self,si,sg,verbose=False,full=False,h=None):
+        #Find the most probable path from si to sg
+        #  The search stops once sg is permanent, so last_tree and d_m_list
+        #  only cover the states settled before it- full=True builds the
+        #  whole max-probability tree over every reachable state instead,
+        #  and keeps it repaired through later updates, so planning again
+        #  from si is just a walk up the tree
+        #  h runs an A* search instead, guided by an upper bound on the
+        #  probability of reaching sg (see astar)
+
+        #Replanning- if returning to a prior plan to sg after diversion, can re-use it
+        #  (not when a full tree or a guided search is asked for)
+        if not(full) and h == None:
+            plan = self.recall(si,sg)
+            if plan != None:
+                return plan
+
+        #Plan off the kept source tree if there is one for si
+        if (full or (self.src != None and self.src.roots == {si})) and si != sg:
+            if self.src == None or self.src.roots != {si}:
+                self.keep(MPT(self,[si],False))
+            acts,path = self.src.path(sg)
+            if acts == -1:
+                self.last_plan = [-1],[-1]
+            else:
+                self.last_goal = sg
+                self.remember(acts,path)
+            return acts,path
 
-        #Check if there are known transitions from the current state
-        if (self.adjacency[si] == []):
-            self.last_plan = [-1],[-1] #if not- clear the plan, in unknown territory
+        #Guided search toward the goal
+        if h != None and si != sg:
+            if not(self.astar(si,sg,h)):
+                self.last_plan = [-1],[-1]
+                return -1,-1
+            self.last_goal = sg
+            acts,path = self.trace(si,sg)
+            self.remember(acts,path)
+            return acts,path
+
+        #Build the tree out to the goal
+        if not(self.search(si,[sg],1,full)):
+            self.last_plan = [-1],[-1] #Unknown territory, or goal unreachable- clear the plan
             return -1,-1 #return flags for 'no path available'
-        else: #Otherwise
 
-            #Prepare a list of states reachable from the current one
-            reachable = [0]*self.S
-            neighs =  self.adjacency[si]+[] #Grab the list of neighbors
+        #Update the flags to the current agent goal (only if reachable)
+        self.last_goal = sg
+
+        #Read the path back out of the tree
+        acts,path = self.trace(si,sg)
+        if acts == -1:
+            self.last_plan = [-1],[-1]
+        else:
+            #Set the most recent planned path to the one just found
+            self.remember(acts,path)
+        return acts,path #Actually return the path
+
+    def find_path_any(self,si,goals,each=False,full=False):
+        #Find the most probable path from si to whichever of goals is likeliest
+        #  One search serves the whole goal set- it stops at the first goal
+        #  made permanent, or once every goal is with each=True, which also
+        #  returns the best path to each goal (-1,-1 where unreachable) as
+        #  a list in goals order: (acts,path),[(acts,path),...]
+        goals = list(goals)
+
+        #Build the tree out to one goal, or all of them
+        found = self.search(si,goals,len(goals) if each else 1,full)
+
+        #The best goal is the first one made permanent
+        acts,path = -1,-1
+        if found:
+            gset = set(goals)
+            for sk in self.ws.order[:self.ws.n]:
+                if int(sk) in gset:
+                    acts,path = self.trace(si,int(sk))
+                    if acts != -1:
+                        self.last_goal = int(sk)
+                        break
+
+        if acts == -1:
+            self.last_plan = [-1],[-1]
+        else:
+            self.remember(acts,path)
+
+        if not(each):
+            return acts,path
+        if not(found):
+            return (acts,path),[(-1,-1) for g in goals]
+        return (acts,path),[self.trace(si,g) for g in goals]
 
-            #While there are paths to explore and the goal has not been found
-            while len(neighs) != 0 and reachable[sg] == 0:
-                reachable[neighs[0]] = 1 #Mark the next neighbor as reachable
+    def search(self,si,goals,need,full=False):
+        #Grow the max-probability tree from si in the workspace until need of
+        #  the goals are permanent (or over every reachable state with full=True)
+        #  Returns False, with no tree, if no goal is reachable at all
 
-                #Grab all the states reachable from that enighbor
-                for n in self.adjacency[neighs[0]]:
-                    if reachable[n] == 0: #If not already seen
-                        neighs = neighs + [n] #Add to the neighbours list
-                        reachable[n] = 1 #Mark as reachable now
-                neighs = neighs[1:] #pop each neighbor as it's handled
+        #A new search replaces any kept source tree
+        self.keep(None)
 
-            if reachable[sg] == 0: #If the goal is not reachable from the current state
-                self.last_plan = [-1],[-1]
-                return -1,-1 #Return no-plan-found 
+        #Check if there are known transitions from the current state
+        if (len(self.adjacency[si]) == 0):
+            return False
 
-        #Update the flags to the current agent goal (only if reachable)
-        self.last_goal = sg
+        #Count the goals reachable from here off the reachability index
+        #  The start only counts as a goal if it can be come back to
+        gset = set(goals)
+        hits = 0
+        for g in gset:
+            if si in self.reach_of(g):
+                hits += 1
 
-        #Grab the max prob and max action arrays for all s/s transitions
-        maxP = self.AF[1,:,:]
-        maxA = self.AF[0,:,:]
+        if hits == 0: #If no goal is reachable from the current state
+            return False
+        need = min(need,hits) #No need to settle more goals than can be reached
 
-        #Prepare the empty max probability tree
-        MPT = np.zeros((self.S,self.S))
+        ws = self.ws
+        gen = ws.begin() #Fresh generation for this query
+        done = ws.done
+        ws.loop = (si in gset and si in self.reach_of(si))
 
         #Variables for Dijkstra's algorithm
-        permanent = [-1]*self.S #Set of states with final paths found
-        distances = [-1]*self.S #Distances from the initial state to each final state
-        distances[si] = 0 #Distanct to the initial state
+        #  permanent states, their parents (tree) and distances live in the
+        #  workspace, stamped with this query's generation
         d_max = -1 #maximum distance
         d_m_list = [] #list of states w/ current max distance
-        boundary_list = [] #list of states on the tree boundary
-        reachable = [si] #List of reached states
+        left = need - 1*ws.loop #Goals still to make permanent
+
+        #Boundary of the tree as a binary heap of (-probability,order,parent,state)
+        #  The order counter breaks ties first-come-first-served, so states pop
+        #  in the same order the old sorted boundary list gave them up. States
+        #  made permanent by an earlier entry are skipped when popped (lazy deletion)
+        boundary_list = ws.heap
+        order = 0
 
         #Initial setup for Dijkstra
-        permanent[si] = None #No predecessor for the root state
-        for sk in self.adjacency[si]: #For each state adjacent to the start
-            if maxP[si,sk] > 0.0: #If there is a non-0 probability of transition
-                boundary_list = boundary_list + [(si,maxP[si,sk],sk)] #Add to the initial boundary list
-        boundary_list.sort(key=lambda get: get[1],reverse=True) #Sort the initial list by probability
+        ws.settle(si,-1,0) #No predecessor for the root state
+        for sk,P_k in self.out(si): #For each state adjacent to the start
+            if P_k > 0.0: #If there is a non-0 probability of transition
+                heapq.heappush(boundary_list,(-P_k,order,si,sk)) #Add to the initial boundary
+                order += 1
 
         t1 = time.time() #For performance monitoring
 
-        #While there are new states to evaluate
-        while len(boundary_list) > 0:
+        #While there are new states to evaluate (and goals still open)
+        while len(boundary_list) > 0 and (full or left > 0):
 
             #Print size of boundary and reachable set every 4 seconds (diagnostic)
             if time.time()-t1 > 4.0:
-                print(len(boundary_list),len(reachable))
+                print(len(boundary_list),ws.n)
 
-            #Strip off already-visited states from the boundary list
-            while len(boundary_list)>0 and permanent[boundary_list[0][2]] != -1:
-                del boundary_list[0]
+            #Strip off already-visited states from the boundary
+            while len(boundary_list)>0 and done[boundary_list[0][3]] == gen:
+                heapq.heappop(boundary_list)
 
             #If there are previously unseen states:
             if len(boundary_list) > 0:
 
-                #Grab the first state off the queue
-                add = boundary_list[0]
-                del boundary_list[0]
+                #Grab the first state off the queue as (parent,probability,state)
+                P_add,_,s_p,s_n = heapq.heappop(boundary_list)
+                P_add = -P_add
 
-                #Update the lists of permanent nodes and distances
-                permanent[add[2]] = add[0]
-                distances[add[2]] = distances[add[0]] + 1
+                #Make it permanent, one step further out than its parent
+                d_n = int(ws.dst[s_p]) + 1
+                ws.settle(s_n,s_p,d_n)
+                if s_n in gset:
+                    left -= 1
 
                 #If the current distance is greatest
-                if distances[add[2]] > d_max:
-                    d_max = distances[add[2]] #Set the new longest distance
-                    d_m_list = [add[2]] #Set the list of max dist states to just this one
-                elif distances[add[2]] == d_max: #If the same distance, add to the current list
-                    d_m_list = d_m_list + [add[2]]
-                reachable = reachable + [add[2]] #Annotate that this state is reachble
-                MPT[add[0],add[2]] = add[1] #Add to the maximum probability tree
-
-                new = [] #Holder list for the new boundary members
-
-                #Grab all adjacent nodes and add to the boundary add-on list
-                for sb in self.adjacency[add[2]]:
-                    new = new + [(add[2],maxP[add[2],sb]*add[1],sb)]
-
-                #Arrange new state list by probability
-                new.sort(key=lambda get: get[1],reverse=True)
-
-                #Insert into the boundary list
-                n = 0
-                while new != []: #While nodes to be added
-                    #loop over nodes with higher probability
-                    while n < len(boundary_list) and boundary_list[n][1] >= new[0][1]:
-                        n+=1
-                    #Insert most probable in new to place in boundary list
-                    if n < len(boundary_list):
-                        boundary_list = boundary_list[:n] + [new[0]] + boundary_list[n:]
-                        del new[0]
-                    else: #If at the end, add all that remain
-                        boundary_list = boundary_list + new
-                        new = []
+                if d_n > d_max:
+                    d_max = d_n #Set the new longest distance
+                    d_m_list = [s_n] #Set the list of max dist states to just this one
+                elif d_n == d_max: #If the same distance, add to the current list
+                    d_m_list.append(s_n)
+
+                #Push all adjacent nodes onto the boundary
+                for sb,P_b in self.out(s_n):
+                    heapq.heappush(boundary_list,(-(P_b*P_add),order,s_n,sb))
+                    order += 1
+
+        #Set note of prior tree (as parent arrays) & max distance list
+        self.tree_c = ws.tree()
+        self.d_m_c = d_m_list
+        return True
+
+    def keep(self,t):
+        #Swap the kept source tree (None for none)
+        if self.src != None:
+            self.trees.remove(self.src)
+        self.src = t
+        if t != None:
+            self.trees.append(t)
+
+    def trace(self,si,sg):
+        #Read the path from si to sg back out of the last search tree
+        ws = self.ws
+
+        #If the goal has no parent in the tree, no path (the start only if it was come back to)
+        if ws.done[sg] != ws.gen or (sg == si and not(ws.loop)):
+            return -1,-1
 
         #Iterating backwards from the goal
-        sk = permanent[sg] #Grab immediate predecessor state
         path = [sg] #'Start' list with goal
         acts = [] #No actions yet
+        sk = int(ws.par[sg]) #Grab immediate predecessor state
+
+        #Until reaching the start state (predecessor of -1)
+        while (sk != -1):
+            path = [sk] + path #Add the current predecessor to the path
+            acts = [int(self.AFa[path[0],path[1]])] + acts #Append the corresponding most-probable action
+            sk = int(ws.par[sk]) #Grab the next predecessor
+        return acts,path
+
+    def bound(self,sg,h):
+        #Per-state upper bounds on the probability of reaching sg, for astar
+        #  'maxout'- a state's best outgoing edge probability (1 at sg),
+        #     self-loops aside
+        #  'hops'- that, times the best edge out of each nearer level of a
+        #     reverse breadth-first sweep from sg (0 if sg can't be reached)
+        #  Both follow from the model's structure alone, and are consistent-
+        #  a bound is never beaten by an edge times the bound past it
+        for s in self.mo_due: #(staying put is never part of a best path)
+            self.mo[s] = max([P for v,P in self.out(s) if v != s],default=0.0)
+        self.mo_due.clear()
+        mo = np.array(self.mo)
+        if h == 'maxout':
+            H = mo
+        elif h == 'hops':
+            g,v,S,d = self.hop_c
+            if g != sg or v != self.adj_v or S != self.S:
+                d = -1*np.ones(self.S,dtype=np.int32)
+                d[sg] = 0
+                front = [sg]
+                while len(front) > 0:
+                    nxt = []
+                    for x in front:
+                        for y in self.radjacency[x]:
+                            if d[y] == -1:
+                                d[y] = d[x] + 1
+                                nxt.append(y)
+                    front = nxt
+                self.hop_c = (sg,self.adj_v,self.S,d)
+            #Any path in from k steps out crosses a state at each of the
+            #  k-1 nearer levels, so pays at most each level's best edge
+            on = d > 0
+            M = np.zeros(int(d.max())+1)
+            np.maximum.at(M,d[on],mo[on])
+            C = np.ones(len(M)+1)
+            C[2:] = np.cumprod(M[1:])
+            H = np.where(on,mo*C[np.maximum(d,0)],0.0)
+        else:
+            raise ValueError("unknown heuristic "+str(h))
+        H[sg] = 1.0
+        return H
+
+    def astar(self,si,sg,h,deadline=None,budget=None):
+        #A* search from si to sg in the workspace
+        #  States are taken in order of (path probability so far)*(bound on
+        #  the rest), so with a bound that never underestimates, the goal is
+        #  reached along a most probable path while states the bound rules
+        #  out are never settled. h is 'maxout' or 'hops' (see bound), a
+        #  callable h(s,sg) giving such a bound, or None for no bound (plain
+        #  Dijkstra)- these are consistent, so settle each state once, while
+        #  a callable may be merely admissible, and may reopen settled
+        #  states (S reopenings at most in all)
+        #  The search gives up at time.time() past deadline, or after budget
+        #  states are settled. Returns True once sg is settled, False if it
+        #  is not reachable, None if stopped short
+        self.keep(None)
+        if len(self.adjacency[si]) == 0 or not(si in self.reach_of(sg)):
+            return False
 
-        #Set note of prior tree & max distance list
-        self.last_tree = (permanent + [],distances+[],reachable+[])
-        self.d_m_list = d_m_list
-
-        #If the goal has no parent in the tree, not path (should never get here with above checks, but for good measure & logical closure)
-        if (sk == -1):
+        if h == None:
+            H = lambda s: 1.0
+        elif callable(h):
+            H = lambda s: float(h(s,sg))
+        else:
+            H = self.bound(sg,h).__getitem__
+
+        ws = self.ws
+        gen = ws.begin()
+        heap = ws.heap
+        order = 0
+        reopen = self.S if callable(h) else 0 #Reopenings left
+        ws.label(si,-1,1.0)
+        heapq.heappush(heap,(-H(si),order,-1.0,si))
+
+        cut = False
+        while len(heap) > 0:
+            #Out of time or expansions
+            if (budget != None and ws.n >= budget) or (deadline != None and time.time() > deadline):
+                cut = True
+                break
+
+            _,_,P_u,u = heapq.heappop(heap)
+            P_u = -P_u
+            if P_u < ws.P[u]: #Stale entry
+                continue
+
+            #Make it permanent (again, if a better path reopened it)
+            p_u = int(ws.par[u])
+            d_u = 0 if p_u == -1 else int(ws.dst[p_u])+1
+            if ws.done[u] != gen:
+                ws.settle(u,p_u,d_u)
+            else:
+                ws.dst[u] = d_u
+            if u == sg:
+                break
+
+            for v,P_v in self.out(u):
+                if v == u: #Staying put never helps
+                    continue
+                q = P_u*P_v
+                if q <= 0.0 or (ws.lab[v] == gen and q <= ws.P[v]):
+                    continue
+                if ws.done[v] == gen: #A better path into a settled state
+                    if reopen <= 0:
+                        continue
+                    reopen -= 1
+                h_v = H(v)
+                if h_v > 0.0: #(a 0 bound says sg can't be reached from v)
+                    ws.label(v,u,q)
+                    order += 1
+                    heapq.heappush(heap,(-(q*h_v),order,-q,v))
+
+        self.tree_c = ws.tree()
+        self.d_m_c = [int(x) for x in self.tree_c[0][self.tree_c[2] == self.tree_c[2].max()]] if ws.n > 0 else []
+        if ws.done[sg] == gen:
+            return True
+        return None if cut else False
+
+    def find_path_anytime(self,si,sg,deadline=None,budget=None,h=None):
+        #Find the best plan from si to sg within a time or expansion budget
+        #  deadline is in seconds from now, budget in settled states, h as
+        #  for astar. Returns acts,path,optimal- optimal is True for a
+        #  proven most probable plan (or proof there is none, with -1,-1).
+        #  Cut short, it gives the best complete plan labelled so far if sg
+        #  was reached, else the plan to the likeliest state on the boundary
+        #  (a prefix to act on while planning continues next step)
+        if si == sg:
+            acts,path = self.find_path(si,sg)
+            return acts,path,True
+        if deadline != None:
+            deadline = time.time() + deadline
+
+        done = self.astar(si,sg,h,deadline,budget)
+        if done == False:
             self.last_plan = [-1],[-1]
-            return -1,-1
+            return -1,-1,True
+        self.last_goal = sg
 
-        #If the goal has a parent, the path exists, get it
+        #Walk back to si from sg, or from the best open state if sg wasn't reached
+        ws = self.ws
+        if ws.lab[sg] == ws.gen:
+            sk = sg
         else:
-            #Until reaching the start state (predecessor of None)
-            while (sk != None):
-                path = [sk] + path #Add the current predecessor to the path
-                acts = [maxA[path[0],path[1]]] + acts #Append the corresponding most-probable action
-                sk = permanent[sk] #Grab the next predecessor
-
-            #Set the most recent planned path to the one just found
-            self.last_plan = acts,path
-            return acts,path #Actually return the path
-
+            while len(ws.heap) > 0 and -ws.heap[0][2] < ws.P[ws.heap[0][3]]:
+                heapq.heappop(ws.heap) #Stale entries
+            sk = ws.heap[0][3] if len(ws.heap) > 0 else si
+        path = []
+        while sk != -1:
+            path.append(int(sk))
+            sk = int(ws.par[sk])
+        path.reverse()
+        acts = [int(self.AFa[path[a],path[a+1]]) for a in range(len(path)-1)]
+
+        #Only a proven plan goes in the plan cache
+        if done == True:
+            self.remember(acts,path)
+        return acts,path,(done == True)
+
+    def find_path_bidir(self,si,sg):
+        #Find the most probable path from si to sg, searching from both ends
+        #  Forward from si over adjacency and backward from sg over radjacency,
+        #  always growing the side whose next state is likelier. Every edge
+        #  that joins the two labelled regions offers a candidate path, and
+        #  the search stops once the two boundary tops multiplied can't beat
+        #  the best of those, so long plans settle about two half-depth balls
+        #  rather than one full-depth one. (wsb holds the backward half)
+
+        #Plans back onto the start go through the one-sided search
+        if si == sg:
+            return self.find_path(si,sg)
+
+        #Unknown territory, or goal unreachable
+        self.keep(None)
+        if len(self.adjacency[si]) == 0 or not(si in self.reach_of(sg)):
+            self.last_plan = [-1],[-1]
+            return -1,-1
+        self.last_goal = sg
 
+        f = self.ws
+        b = self.wsb
+        g_f = f.begin()
+        g_b = b.begin()
+        f.label(si,-1,1.0)
+        b.label(sg,-1,1.0)
+        f.heap.append((-1.0,si))
+        b.heap.append((-1.0,sg))
+
+        mu = 0.0 #Best joined path probability so far
+        meet = (-1,-1) #...and the edge joining it
+
+        while len(f.heap) > 0 and len(b.heap) > 0:
+
+            #Strip off already-settled states from each boundary
+            while len(f.heap) > 0 and f.done[f.heap[0][1]] == g_f:
+                heapq.heappop(f.heap)
+            while len(b.heap) > 0 and b.done[b.heap[0][1]] == g_b:
+                heapq.heappop(b.heap)
+            if len(f.heap) == 0 or len(b.heap) == 0:
+                break
+
+            #Nothing left on either side can do better than the best found
+            if f.heap[0][0]*b.heap[0][0] <= mu:
+                break
+
+            if f.heap[0][0] <= b.heap[0][0]: #Grow forward
+                P_u,u = heapq.heappop(f.heap)
+                P_u = -P_u
+                p_u = int(f.par[u])
+                f.settle(u,p_u,0 if p_u == -1 else int(f.dst[p_u])+1)
+                for v,P_e in self.out(u):
+                    q = P_u*P_e
+                    if q <= 0.0:
+                        continue
+                    if f.lab[v] != g_f or q > f.P[v]:
+                        f.label(v,u,q)
+                        heapq.heappush(f.heap,(-q,v))
+                    if b.lab[v] == g_b and q*b.P[v] > mu:
+                        mu = q*b.P[v]
+                        meet = (u,v)
+
+            else: #Grow backward
+                P_v,v = heapq.heappop(b.heap)
+                P_v = -P_v
+                p_v = int(b.par[v])
+                b.settle(v,p_v,0 if p_v == -1 else int(b.dst[p_v])+1)
+                for u in self.radjacency[v]:
+                    q = P_v*self.prob(u,v)
+                    if q <= 0.0:
+                        continue
+                    if b.lab[u] != g_b or q > b.P[u]:
+                        b.label(u,v,q)
+                        heapq.heappush(b.heap,(-q,u))
+                    if f.lab[u] == g_f and q*f.P[u] > mu:
+                        mu = q*f.P[u]
+                        meet = (u,v)
+
+        #Forward part of the tree for last_tree
+        self.tree_c = f.tree()
+        self.d_m_c = [int(x) for x in self.tree_c[0][self.tree_c[2] == self.tree_c[2].max()]] if f.n > 0 else []
+
+        if mu <= 0.0:
+            self.last_plan = [-1],[-1]
+            return -1,-1
 
+        #Join the forward chain into the meeting edge with the backward chain out of it
+        u,v = meet
+        path = []
+        sk = u
+        while sk != -1:
+            path.append(sk)
+            sk = int(f.par[sk])
+        path.reverse()
+        sk = v
+        while sk != -1:
+            path.append(sk)
+            sk = int(b.par[sk])
+        acts = [int(self.AFa[path[a],path[a+1]]) for a in range(len(path)-1)]
+
+        self.remember(acts,path)
+        return acts,path